@@ -1,54 +1,78 @@
 # Created by Claude Sonnet 3.5 (author: Nicholas Beaudoin)
 import streamlit as st
 from langchain_openai import ChatOpenAI
-from langchain_core.messages import SystemMessage, HumanMessage, AIMessage
+from langchain_core.messages import BaseMessage, HumanMessage, AIMessage
+from langchain_core.runnables import Runnable
 from langchain.callbacks import OpenAICallbackHandler
 import os
-from typing import List, Dict, Any, Optional
-import json
+import sqlite3
+import uuid
+from typing import List, Dict, Any, Optional, Tuple
+import re
+import msgspec
+import json5
 from dotenv import load_dotenv
-from datetime import datetime
+from datetime import datetime, timedelta
+import time
 import tiktoken
 from contextlib import contextmanager
 import traceback
+import logging
+from logging.handlers import RotatingFileHandler
+from tutor_prompt import SYSTEM_MESSAGE, SYSTEM_PROMPT_VALID
+from tutor_reply import TutorReply, TUTOR_DECODER, TUTOR_REPLY_FUNCTION
 
 # Load environment variables from .env file
 load_dotenv()
 
+# Log tracebacks to a rotating file; the script reruns often, so attach the handler only once
+logger = logging.getLogger("chinese_tutor")
+if not logger.handlers:
+    _log_handler = RotatingFileHandler(
+        os.getenv('TUTOR_LOG_FILE', 'tutor.log'), maxBytes=1_000_000, backupCount=3, encoding="utf-8"
+    )
+    _log_handler.setFormatter(logging.Formatter("%(asctime)s %(levelname)s %(message)s"))
+    logger.addHandler(_log_handler)
+    logger.setLevel(logging.INFO)
+
 # Initialize Streamlit page configuration
 st.set_page_config(page_title="Chinese Language Tutor", page_icon="🇨🇳", layout="wide")
 
-# HSK 4 vocabulary and grammar examples for the tutor's reference
-HSK4_REFERENCE = {
-    "vocab_examples": [
-        "建议", "根据", "要求", "一般来说", "比如", "关系", "参加",
-        "经验", "实际", "态度", "表示", "发生", "方便", "符合"
-    ],
-    "grammar_patterns": [
-        "是...的", "越...越...", "虽然...但是...", "不管...都...",
-        "除了...以外...", "一边...一边...", "从来不", "要是...就..."
-    ]
-}
-
-# Enhanced system prompt for the tutor
-SYSTEM_PROMPT = """You are a helpful Chinese language tutor specifically teaching at the HSK 4 level. 
-You should:
-1. Respond to student messages in Chinese (using HSK 4 level vocabulary and grammar)
-2. Provide pinyin for all Chinese characters
-3. Provide English translations
-4. If the student writes in Chinese, correct any mistakes they make
-5. Use appropriate HSK 4 vocabulary and grammar patterns in your responses
-6. Be encouraging and supportive
-
-Format your responses as JSON with the following structure:
-{
-    "chinese": "Chinese text using HSK 4 vocabulary",
-    "pinyin": "Pinyin with tones",
-    "english": "English translation",
-    "corrections": "Corrections for student mistakes (if any)",
-    "explanation": "Grammar and vocabulary explanations",
-    "tips": "Learning suggestions or mnemonics (optional)"
-}"""
+# Streaming display throttle: redraw at most ~20 times per second
+STREAM_FLUSH_INTERVAL = 0.05
+STREAM_FLUSH_MIN_CHARS = 8
+
+# Conversation context sent to the model: last N turns, capped by token budget
+CONTEXT_WINDOW_TURNS = 8
+CONTEXT_TOKEN_LIMIT = 1500
+
+# Chat format overhead for gpt-4: 3 framing tokens + 1 role token per message,
+# plus 3 tokens priming the assistant reply
+TOKENS_PER_MESSAGE = 4
+REPLY_PRIMING_TOKENS = 3
+
+# Number of past messages rendered per page of conversation history
+HISTORY_PAGE_SIZE = 20
+
+# Maximum number of queued questions sent to the model at the same time
+BATCH_MAX_CONCURRENCY = 4
+
+# Directory for per-session interaction logs
+HISTORY_DIR = os.getenv('TUTOR_HISTORY_DIR', '.tutor_sessions')
+# Session logs untouched for this many days are deleted when a new session starts
+HISTORY_RETENTION_DAYS = float(os.getenv('TUTOR_HISTORY_RETENTION_DAYS', '7'))
+
+def log_exception(message: str):
+    """Record the active exception; tracebacks only reach the UI when DEBUG is set."""
+    if os.getenv('DEBUG'):
+        st.error(traceback.format_exc())
+    else:
+        logger.exception(message)
+
+@st.cache_resource
+def _get_encoder(model: str) -> tiktoken.Encoding:
+    """Load the tiktoken encoding for a model once per process, surviving script reruns."""
+    return tiktoken.encoding_for_model(model)
 
 class TokenTracker:
     """Custom token tracking class with detailed statistics."""
@@ -57,12 +81,16 @@ class TokenTracker:
         self.prompt_tokens = 0
         self.completion_tokens = 0
         self.total_cost = 0
-        self.session_start = datetime.now()
+        self.session_start_mono = time.monotonic_ns()
         self.history: List[Dict[str, Any]] = []
-        self._encoder = tiktoken.encoding_for_model("gpt-4")
+        self._encoder = _get_encoder("gpt-4")
+        self._count_cache: Dict[int, int] = {}
+        # The function definition is sent with every request
+        self._function_tokens = len(self._encoder.encode(msgspec.json.encode(TUTOR_REPLY_FUNCTION).decode()))
 
     def add_interaction(self, prompt_tokens: int, completion_tokens: int, cost: float):
         """Record a new interaction's token usage."""
+        # Wall clock read once per interaction, only for the display timestamp
         interaction = {
             'timestamp': datetime.now(),
             'prompt_tokens': prompt_tokens,
@@ -80,10 +108,26 @@ class TokenTracker:
         self.total_tokens = self.prompt_tokens + self.completion_tokens
         self.total_cost += interaction['cost']
 
-    def estimate_tokens(self, text: str) -> int:
-        """Estimate token count for a piece of text."""
+    def count_message_tokens(self, messages: List[BaseMessage]) -> int:
+        """Count content tokens across a list of messages, memoized per message."""
+        # Message content never changes after creation, so counts are cached by identity
+        for message in messages:
+            if id(message) not in self._count_cache:
+                # Count special-token text like "<|endoftext|>" as plain text instead of raising
+                self._count_cache[id(message)] = len(
+                    self._encoder.encode(message.content, disallowed_special=())
+                )
+        return sum(self._count_cache[id(message)] for message in messages)
+
+    def estimate_messages(self, messages: List[BaseMessage]) -> int:
+        """Estimate prompt tokens for a chat request, including framing and the function schema."""
         try:
-            return len(self._encoder.encode(text))
+            return (
+                self.count_message_tokens(messages)
+                + len(messages) * TOKENS_PER_MESSAGE
+                + REPLY_PRIMING_TOKENS
+                + self._function_tokens
+            )
         except Exception as e:
             st.warning(f"Token estimation failed: {str(e)}")
             return 0
@@ -92,7 +136,7 @@ class TokenTracker:
         """Get detailed statistics for the current session."""
         try:
             return {
-                'session_duration': str(datetime.now() - self.session_start).split('.')[0],
+                'session_duration': str(timedelta(seconds=(time.monotonic_ns() - self.session_start_mono) // 1_000_000_000)),
                 'total_interactions': len(self.history),
                 'total_tokens': self.total_tokens,
                 'prompt_tokens': self.prompt_tokens,
@@ -105,16 +149,62 @@ class TokenTracker:
             st.error(f"Error calculating session stats: {str(e)}")
             return {}
 
+def prune_session_logs():
+    """Delete session logs that have not been written to within the retention period."""
+    cutoff = time.time() - HISTORY_RETENTION_DAYS * 86400
+    for name in os.listdir(HISTORY_DIR):
+        path = os.path.join(HISTORY_DIR, name)
+        try:
+            if name.endswith(".sqlite3") and os.path.getmtime(path) < cutoff:
+                os.remove(path)
+        except OSError:
+            logger.warning("Could not prune session log %s", path)
+
+class InteractionStore:
+    """Append-only interaction log kept in a per-session SQLite file instead of session state."""
+    def __init__(self, session_id: str):
+        os.makedirs(HISTORY_DIR, exist_ok=True)
+        prune_session_logs()
+        self.path = os.path.join(HISTORY_DIR, f"{session_id}.sqlite3")
+        with self._connect() as conn:
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS interactions ("
+                "id INTEGER PRIMARY KEY, timestamp TEXT, prompt TEXT, response BLOB)"
+            )
+
+    @contextmanager
+    def _connect(self):
+        conn = sqlite3.connect(self.path)
+        try:
+            with conn:
+                yield conn
+        finally:
+            conn.close()
+
+    def add_interactions(self, interactions: List[Dict[str, Any]]):
+        """Write interactions in one transaction; responses are stored as msgpack."""
+        # The log is write-only; a failed write must not look like a failed answer
+        try:
+            rows = [
+                (
+                    interaction['timestamp'].isoformat(),
+                    interaction['prompt'],
+                    msgspec.msgpack.encode(interaction['response']),
+                )
+                for interaction in interactions
+            ]
+            with self._connect() as conn:
+                conn.executemany(
+                    "INSERT INTO interactions (timestamp, prompt, response) VALUES (?, ?, ?)", rows
+                )
+        except (sqlite3.Error, OSError, msgspec.EncodeError):
+            log_exception("Interaction log write failed")
+
 def validate_system_prompt() -> bool:
     """Validate the system prompt structure and content."""
-    try:
-        if "{" not in SYSTEM_PROMPT or "}" not in SYSTEM_PROMPT:
-            st.error("Missing JSON format example in system prompt")
-            return False
-        return True
-    except Exception as e:
-        st.error(f"Error validating system prompt: {str(e)}")
-        return False
+    if not SYSTEM_PROMPT_VALID:
+        st.error("Missing JSON format example in system prompt")
+    return SYSTEM_PROMPT_VALID
 
 def initialize_session_state():
     """Initialize session state variables with enhanced tracking."""
@@ -123,68 +213,204 @@ def initialize_session_state():
         st.stop()
 
     if 'messages' not in st.session_state:
-        st.session_state.messages = [
-            SystemMessage(content=SYSTEM_PROMPT)
-        ]
+        st.session_state.messages = [SYSTEM_MESSAGE]
     if 'token_tracker' not in st.session_state:
         st.session_state.token_tracker = TokenTracker()
     if 'error_count' not in st.session_state:
         st.session_state.error_count = 0
-    if 'interaction_history' not in st.session_state:
-        st.session_state.interaction_history = []
+    if 'session_id' not in st.session_state:
+        st.session_state.session_id = uuid.uuid4().hex
+    if 'interaction_store' not in st.session_state:
+        st.session_state.interaction_store = InteractionStore(st.session_state.session_id)
+    if 'history_limit' not in st.session_state:
+        st.session_state.history_limit = HISTORY_PAGE_SIZE
+    if 'parsed_cache' not in st.session_state:
+        # id(AIMessage) -> (content, formatted markdown)
+        st.session_state.parsed_cache = {}
+
+_CODE_FENCE_RE = re.compile(r"^```(?:json)?\s*|\s*```$", flags=re.M)
 
-def parse_response(response_text: str) -> Dict[str, str]:
-    """Parse the AI response from JSON to dict with error handling."""
+def _extract_json_object(text: str) -> Optional[str]:
+    """Return the first balanced {...} block in text, ignoring braces inside strings."""
+    start = text.find("{")
+    if start == -1:
+        return None
+    depth = 0
+    in_string = False
+    escaped = False
+    for i in range(start, len(text)):
+        char = text[i]
+        if in_string:
+            if escaped:
+                escaped = False
+            elif char == "\\":
+                escaped = True
+            elif char == '"':
+                in_string = False
+        elif char == '"':
+            in_string = True
+        elif char == "{":
+            depth += 1
+        elif char == "}":
+            depth -= 1
+            if depth == 0:
+                return text[start:i + 1]
+    return None
+
+def repair_response(response_text: str) -> Optional[TutorReply]:
+    """Try to recover a reply from almost-JSON output (code fences, stray prose, trailing commas)."""
+    candidate = _CODE_FENCE_RE.sub("", response_text.strip())
+    candidate = _extract_json_object(candidate) or candidate
     try:
-        response_dict = json.loads(response_text)
-        required_fields = ["chinese", "pinyin", "english", "corrections", "explanation"]
-        
-        for field in required_fields:
-            if field not in response_dict:
-                response_dict[field] = ""
-        
-        return response_dict
-    except json.JSONDecodeError:
+        return TUTOR_DECODER.decode(candidate)
+    except msgspec.DecodeError:
+        pass
+    try:
+        reply_obj = msgspec.json.decode(candidate)
+    except msgspec.DecodeError:
+        # json5 is slow but tolerant; only reached for malformed replies
+        try:
+            reply_obj = json5.loads(candidate)
+        except ValueError:
+            return None
+    return coerce_reply(reply_obj)
+
+def coerce_reply(reply_obj: Any) -> Optional[TutorReply]:
+    """Build a TutorReply from loosely typed JSON, joining lists and stringifying other values."""
+    if not isinstance(reply_obj, dict):
+        return None
+    fields = {}
+    for name in TutorReply.__struct_fields__:
+        value = reply_obj.get(name)
+        if value is None:
+            continue
+        if isinstance(value, list):
+            value = "\n".join(str(item) for item in value)
+        elif not isinstance(value, str):
+            value = str(value)
+        fields[name] = value
+    return TutorReply(**fields)
+
+def reply_text(message: BaseMessage) -> str:
+    """Return the reply JSON from a message or chunk, preferring the function-call arguments."""
+    function_call = message.additional_kwargs.get("function_call")
+    if function_call:
+        return function_call.get("arguments") or ""
+    return message.content
+
+def looks_complete_json(text: str) -> bool:
+    """Cheap completeness check: a finished JSON object ends with a closing brace."""
+    return text.rstrip().endswith("}")
+
+def parse_response(response_text: str) -> TutorReply:
+    """Parse the AI response from JSON into a TutorReply with error handling."""
+    try:
+        # A reply that doesn't end in "}" can't be strict JSON; only try the strict decode otherwise
+        if looks_complete_json(response_text):
+            try:
+                # Decoding into TutorReply validates the schema and fills missing fields
+                return TUTOR_DECODER.decode(response_text)
+            except msgspec.DecodeError:
+                pass
+
+        reply = repair_response(response_text)
+        if reply is not None:
+            return reply
         st.error("Failed to parse tutor response as JSON")
-        return {
-            "chinese": response_text,
-            "pinyin": "Error parsing response",
-            "english": "Error parsing response",
-            "corrections": "Error in response format",
-            "explanation": "Please try again"
-        }
+        return TutorReply(
+            chinese=response_text,
+            pinyin="Error parsing response",
+            english="Error parsing response",
+            corrections="Error in response format",
+            explanation="Please try again"
+        )
     except Exception as e:
         st.error(f"Unexpected error parsing response: {str(e)}")
-        return {
-            "chinese": "Error processing response",
-            "pinyin": "Error",
-            "english": "Error",
-            "corrections": str(e),
-            "explanation": "Please try again"
-        }
+        return TutorReply(
+            chinese="Error processing response",
+            pinyin="Error",
+            english="Error",
+            corrections=str(e),
+            explanation="Please try again"
+        )
+
+_CHINESE_PREFIX = "🈺 "
+_PINYIN_PREFIX = "🔈 "
+_ENGLISH_PREFIX = "🌏 "
+_CORRECTIONS_PREFIX = "✍️ Corrections: "
+_EXPLANATION_PREFIX = "📝 Note: "
+_TIPS_PREFIX = "💡 Tip: "
 
-def format_message(message_dict: Dict[str, str]) -> str:
-    """Format the message dictionary for display with error handling."""
+def format_message(reply: TutorReply) -> str:
+    """Format a tutor reply for display with error handling."""
     try:
-        formatted = f"🈺 {message_dict.get('chinese', 'No Chinese text')}\n\n"
-        formatted += f"🔈 {message_dict.get('pinyin', 'No pinyin')}\n\n"
-        formatted += f"🌏 {message_dict.get('english', 'No translation')}\n\n"
-        
-        if message_dict.get('corrections'):
-            formatted += f"✍️ Corrections: {message_dict['corrections']}\n\n"
-        
-        if message_dict.get('explanation'):
-            formatted += f"📝 Note: {message_dict['explanation']}\n\n"
-            
-        if message_dict.get('tips'):
-            formatted += f"💡 Tip: {message_dict['tips']}"
-            
-        return formatted
+        parts = [
+            _CHINESE_PREFIX + (reply.chinese or 'No Chinese text'),
+            _PINYIN_PREFIX + (reply.pinyin or 'No pinyin'),
+            _ENGLISH_PREFIX + (reply.english or 'No translation'),
+        ]
+
+        # Optional sections are only added when present
+        if reply.corrections:
+            parts.append(_CORRECTIONS_PREFIX + reply.corrections)
+
+        if reply.explanation:
+            parts.append(_EXPLANATION_PREFIX + reply.explanation)
+
+        if reply.tips:
+            parts.append(_TIPS_PREFIX + reply.tips)
+
+        return "\n\n".join(parts)
     except Exception as e:
         st.error(f"Error formatting message: {str(e)}")
         return "Error displaying message. Please try again."
 
-def setup_openai() -> Optional[ChatOpenAI]:
+def build_context(messages: List[BaseMessage], token_tracker: TokenTracker) -> List[BaseMessage]:
+    """Build the request for the model: the system prompt plus a bounded window of recent turns."""
+    system_message, history = messages[0], messages[1:]
+    window = history[-2 * CONTEXT_WINDOW_TURNS:]
+
+    # Drop the oldest messages until the window fits the token budget,
+    # always keeping the latest user message
+    try:
+        while len(window) > 1 and token_tracker.count_message_tokens(window) > CONTEXT_TOKEN_LIMIT:
+            window = window[1:]
+    except Exception as e:
+        st.warning(f"Token estimation failed: {str(e)}")
+    # Never start the window on an orphaned tutor reply
+    while len(window) > 1 and isinstance(window[0], AIMessage):
+        window = window[1:]
+
+    return [system_message] + window
+
+def get_formatted_message(message: AIMessage) -> str:
+    """Return the formatted markdown for an AI message, reusing cached results across reruns."""
+    cache: Dict[int, Tuple[str, str]] = st.session_state.parsed_cache
+    cached = cache.get(id(message))
+    if cached is not None and cached[0] == message.content:
+        return cached[1]
+
+    formatted = format_message(parse_response(message.content))
+    cache[id(message)] = (message.content, formatted)
+    return formatted
+
+@st.cache_resource
+def _get_llm(api_key: str) -> Runnable:
+    """Create the chat model once and reuse it (and its HTTP connection pool) across reruns."""
+    llm = ChatOpenAI(
+        temperature=0.7,
+        model_name="gpt-4",
+        openai_api_key=api_key,
+        streaming=True,
+        # Remove any proxy settings
+    )
+    # Force every reply through the TutorReply function schema
+    return llm.bind(
+        functions=[TUTOR_REPLY_FUNCTION],
+        function_call={"name": TUTOR_REPLY_FUNCTION["name"]},
+    )
+
+def setup_openai() -> Optional[Runnable]:
     """Setup OpenAI API key and model with error handling."""
     try:
         api_key = os.getenv('OPENAI_API_KEY')
@@ -193,24 +419,11 @@ def setup_openai() -> Optional[ChatOpenAI]:
             st.info("Please create a .env file with your OpenAI API key: OPENAI_API_KEY=your-key-here")
             st.stop()
             
-        llm = ChatOpenAI(
-            temperature=0.7,
-            model_name="gpt-4",
-            openai_api_key=api_key,
-            # Remove any proxy settings
-        )
-        return llm
-            
-    except Exception as e:
-        st.error(f"Error initializing OpenAI client: {str(e)}")
-        st.error(traceback.format_exc())
-        st.stop()
-        return None
-        
+        return _get_llm(api_key)
             
     except Exception as e:
         st.error(f"Error initializing OpenAI client: {str(e)}")
-        st.error(traceback.format_exc())
+        log_exception("OpenAI setup failed")
         st.stop()
         return None
 
@@ -238,6 +451,79 @@ def display_token_stats():
     except Exception as e:
         st.sidebar.error(f"Error displaying statistics: {str(e)}")
 
+def show_earlier_messages():
+    """Extend the rendered history window by one page."""
+    st.session_state.history_limit += HISTORY_PAGE_SIZE
+
+def render_question_queue() -> List[str]:
+    """Sidebar form for staging several questions; returns them once submitted."""
+    # Widget state can only be reset before the widget is created
+    if 'question_queue_reset' in st.session_state:
+        st.session_state.question_queue_text = st.session_state.pop('question_queue_reset')
+    with st.sidebar.form("question_queue"):
+        st.markdown("### Question Queue")
+        for error in st.session_state.pop('question_queue_errors', []):
+            st.error(error)
+        queued_text = st.text_area("One question per line", height=120, key="question_queue_text")
+        submitted = st.form_submit_button("Ask all")
+    if not submitted:
+        return []
+    return [line.strip() for line in queued_text.splitlines() if line.strip()]
+
+def answer_queued_questions(llm: Runnable, questions: List[str]) -> List[str]:
+    """Answer independent questions in one batch, each with only the system prompt as context.
+
+    Returns the questions that could not be answered.
+    """
+    try:
+        requests = [
+            [SYSTEM_MESSAGE, HumanMessage(content=question)]
+            for question in questions
+        ]
+        with st.spinner(f"Answering {len(questions)} questions..."):
+            responses = llm.batch(
+                requests,
+                config={"max_concurrency": BATCH_MAX_CONCURRENCY},
+                return_exceptions=True,
+            )
+    except Exception as e:
+        st.session_state.question_queue_errors = [f"Error generating responses: {str(e)}"]
+        log_exception("Batch response generation failed")
+        st.session_state.error_count += 1
+        return questions
+
+    interactions = []
+    failed = []
+    errors = []
+    for question, response in zip(questions, responses):
+        # A failed item is reported next to the queue and kept out of the conversation history
+        if isinstance(response, Exception):
+            errors.append(f"Error answering \"{question}\": {str(response)}")
+            logger.error("Batch item failed: %r", response)
+            st.session_state.error_count += 1
+            failed.append(question)
+            continue
+
+        # The caller reruns, so answers are rendered by the history replay from the parse cache
+        st.session_state.messages.append(HumanMessage(content=question))
+        response_text = reply_text(response)
+        reply = parse_response(response_text)
+        formatted = format_message(reply)
+        ai_message = AIMessage(content=response_text)
+        st.session_state.messages.append(ai_message)
+        st.session_state.parsed_cache[id(ai_message)] = (response_text, formatted)
+
+        interactions.append({
+            'timestamp': datetime.now(),
+            'prompt': question,
+            'response': reply
+        })
+    if interactions:
+        st.session_state.interaction_store.add_interactions(interactions)
+    if errors:
+        st.session_state.question_queue_errors = errors
+    return failed
+
 def main():
     try:
         initialize_session_state()
@@ -256,51 +542,93 @@ def main():
         - Get vocabulary help
         """)
         
-        # Display conversation history
-        for message in st.session_state.messages[1:]:
+        # Display conversation history, only the most recent page unless more is requested
+        history = st.session_state.messages[1:]
+        hidden_count = len(history) - st.session_state.history_limit
+        if hidden_count > 0:
+            st.button(f"Load earlier messages ({hidden_count})", on_click=show_earlier_messages)
+        for message in history[-st.session_state.history_limit:]:
             if isinstance(message, HumanMessage):
                 with st.chat_message("user"):
                     st.markdown(message.content)
             elif isinstance(message, AIMessage):
                 with st.chat_message("assistant"):
                     try:
-                        response_dict = parse_response(message.content)
-                        st.markdown(format_message(response_dict))
+                        st.markdown(get_formatted_message(message))
                     except Exception as e:
                         st.error(f"Error displaying message: {str(e)}")
         
         # User input handling
-        if prompt := st.chat_input("Type your message here (English or Chinese)"):
+        queued_questions = render_question_queue()
+        prompt = st.chat_input("Type your message here (English or Chinese)")
+        # A single queued question goes through the normal streaming path
+        from_queue = not prompt and len(queued_questions) == 1
+        if from_queue:
+            prompt = queued_questions.pop()
+
+        if queued_questions and not prompt:
+            # Put back only the questions that still need an answer so they can be retried
+            failed = answer_queued_questions(llm, queued_questions)
+            st.session_state.question_queue_reset = "\n".join(failed)
+            st.rerun()
+        elif prompt:
             st.session_state.messages.append(HumanMessage(content=prompt))
             with st.chat_message("user"):
                 st.markdown(prompt)
             
-            # Estimate tokens before making API call
-            estimated_tokens = st.session_state.token_tracker.estimate_tokens(prompt)
+            # Full history stays in session state for display; only a window is sent
+            context = build_context(st.session_state.messages, st.session_state.token_tracker)
+
+            # Estimate tokens for the full request before making API call
+            estimated_tokens = st.session_state.token_tracker.estimate_messages(context)
             st.sidebar.markdown(f"Estimated tokens for input: {estimated_tokens}")
             
             with st.chat_message("assistant"):
                 try:
-                    with st.spinner("Thinking..."):
-                        callback = OpenAICallbackHandler()
-                        response = llm.invoke(
-                            [message for message in st.session_state.messages]
-                        )
-                        
-                        response_dict = parse_response(response.content)
-                        st.markdown(format_message(response_dict))
-                        st.session_state.messages.append(AIMessage(content=response.content))
-                            
-                        # Record successful interaction
-                        st.session_state.interaction_history.append({
-                            'timestamp': datetime.now(),
-                            'prompt': prompt,
-                            'response': response_dict
-                        })
-                            
+                    callback = OpenAICallbackHandler()
+                    stream = llm.stream(context)
+
+                    # Show raw text while tokens arrive; format once at the end
+                    placeholder = st.empty()
+                    # Shown until the first throttled flush replaces it
+                    placeholder.markdown("_Thinking..._")
+                    # Collect chunks in a list and join on flush to avoid quadratic string growth
+                    buf: List[str] = []
+                    last_flush = time.monotonic()
+                    pending_chars = 0
+                    for chunk in stream:
+                        text = reply_text(chunk)
+                        buf.append(text)
+                        pending_chars += len(text)
+                        now = time.monotonic()
+                        if now - last_flush >= STREAM_FLUSH_INTERVAL and pending_chars >= STREAM_FLUSH_MIN_CHARS:
+                            placeholder.text("".join(buf))
+                            last_flush = now
+                            pending_chars = 0
+                    response_text = "".join(buf)
+
+                    # Final flush replaces the raw text with the formatted reply
+                    reply = parse_response(response_text)
+                    formatted = format_message(reply)
+                    placeholder.markdown(formatted)
+                    ai_message = AIMessage(content=response_text)
+                    st.session_state.messages.append(ai_message)
+                    st.session_state.parsed_cache[id(ai_message)] = (response_text, formatted)
+
+                    # Record successful interaction
+                    st.session_state.interaction_store.add_interactions([{
+                        'timestamp': datetime.now(),
+                        'prompt': prompt,
+                        'response': reply
+                    }])
+
+                    if from_queue:
+                        st.session_state.question_queue_reset = ""
+                        st.rerun()
+
                 except Exception as e:
                     st.error(f"Error generating response: {str(e)}")
-                    st.error(traceback.format_exc())
+                    log_exception("Response generation failed")
                     st.session_state.error_count += 1
                     
                     if st.session_state.error_count >= 3:
@@ -313,15 +641,18 @@ def main():
         if st.sidebar.button("Reset Conversation"):
             confirm = st.sidebar.button("Click again to confirm reset")
             if confirm:
-                st.session_state.messages = [SystemMessage(content=SYSTEM_PROMPT)]
+                st.session_state.messages = [SYSTEM_MESSAGE]
                 st.session_state.token_tracker = TokenTracker()
                 st.session_state.error_count = 0
-                st.session_state.interaction_history = []
+                st.session_state.session_id = uuid.uuid4().hex
+                st.session_state.interaction_store = InteractionStore(st.session_state.session_id)
+                st.session_state.parsed_cache = {}
+                st.session_state.history_limit = HISTORY_PAGE_SIZE
                 st.rerun()
 
     except Exception as e:
         st.error(f"Critical error in main application: {str(e)}")
-        st.error(traceback.format_exc())
+        log_exception("Critical error in main application")
         st.warning("Please refresh the page or reset the conversation.")
 
 if __name__ == "__main__":
@@ -0,0 +1,42 @@
+"""System prompt for the Chinese tutor, built once per process.
+
+Streamlit re-executes app.py on every rerun, but imported modules stay in
+sys.modules, so the values here are only computed on first import.
+"""
+from langchain_core.messages import SystemMessage
+
+# HSK 4 vocabulary and grammar examples for the tutor's reference
+HSK4_REFERENCE = {
+    "vocab_examples": [
+        "建议", "根据", "要求", "一般来说", "比如", "关系", "参加",
+        "经验", "实际", "态度", "表示", "发生", "方便", "符合"
+    ],
+    "grammar_patterns": [
+        "是...的", "越...越...", "虽然...但是...", "不管...都...",
+        "除了...以外...", "一边...一边...", "从来不", "要是...就..."
+    ]
+}
+
+# Enhanced system prompt for the tutor
+SYSTEM_PROMPT = """You are a helpful Chinese language tutor specifically teaching at the HSK 4 level. 
+You should:
+1. Respond to student messages in Chinese (using HSK 4 level vocabulary and grammar)
+2. Provide pinyin for all Chinese characters
+3. Provide English translations
+4. If the student writes in Chinese, correct any mistakes they make
+5. Use appropriate HSK 4 vocabulary and grammar patterns in your responses
+6. Be encouraging and supportive
+
+Format your responses as JSON with the following structure:
+{
+    "chinese": "Chinese text using HSK 4 vocabulary",
+    "pinyin": "Pinyin with tones",
+    "english": "English translation",
+    "corrections": "Corrections for student mistakes (if any)",
+    "explanation": "Grammar and vocabulary explanations",
+    "tips": "Learning suggestions or mnemonics (optional)"
+}"""
+
+# Shared by every session; LangChain messages are never mutated after creation
+SYSTEM_MESSAGE = SystemMessage(content=SYSTEM_PROMPT)
+SYSTEM_PROMPT_VALID = "{" in SYSTEM_PROMPT and "}" in SYSTEM_PROMPT
@@ -0,0 +1,30 @@
+"""Structured reply format for the Chinese tutor, built once per process.
+
+Kept out of app.py so the struct, its decoder and the function schema generated
+from it are created on first import and stay consistent across Streamlit reruns.
+"""
+from typing import Optional
+
+import msgspec
+
+class TutorReply(msgspec.Struct, frozen=True):
+    """Structured tutor reply matching the JSON format in SYSTEM_PROMPT."""
+    chinese: str = ""
+    pinyin: str = ""
+    english: str = ""
+    # Optional sections may come back as null when there is nothing to say
+    corrections: Optional[str] = None
+    explanation: Optional[str] = None
+    tips: Optional[str] = None
+
+# Decoder specialized for TutorReply at construction time, reused for every reply
+TUTOR_DECODER = msgspec.json.Decoder(TutorReply)
+
+# OpenAI function schema generated from TutorReply, so the struct is the single source of truth
+_, _REPLY_SCHEMAS = msgspec.json.schema_components([TutorReply])
+TUTOR_REPLY_FUNCTION = {
+    "name": "tutor_reply",
+    "description": "Reply to the student in the tutor's structured format.",
+    # Every field has a default in the struct, so mark the core ones required explicitly
+    "parameters": {**_REPLY_SCHEMAS["TutorReply"], "required": ["chinese", "pinyin", "english"]},
+}